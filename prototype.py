@@ -56,8 +56,7 @@ if __name__ == '__main__':
     print(f"{count} packets used.")
 
     # Verify recovered data matches original
-    decoded_data = b''.join(decoder.recovered[i] for i in range(num_blocks))
-    decoded_data = decoded_data[:len(original_data)]
+    decoded_data = decoder.get_data(len(original_data))
 
     # Write recovered file for inspection
     with open(f"output/{file_name}", "wb") as f:
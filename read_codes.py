@@ -15,11 +15,13 @@ import pyzbar.pyzbar as pyzbar
 from pyzbar.pyzbar import ZBarSymbol
 from tools import decode_packet_with_bitmask, LTDecoder
 
-def decode_qr_code_pyzbar(qr_path: str):
+def decode_qr_code_pyzbar(qr):
     """
     Decode a single QR code image and return raw bytes.
+    qr is an image path, or an already loaded PIL image or numpy array
+    (e.g. a camera frame), which is handed to zbar without re-reading.
     """
-    img = Image.open(qr_path)
+    img = Image.open(qr) if isinstance(qr, (str, os.PathLike)) else qr
     decoded_objects = pyzbar.decode(img, symbols=[ZBarSymbol.QRCODE])
 
     if not decoded_objects:
@@ -79,15 +81,14 @@ if __name__ == "__main__":
         indices, packet = decode_packet_with_bitmask(raw, num_blocks)
         decoder.add_packet(indices, packet)
 
-        print(f"QR {idx}: degree={len(indices)}, recovered={len(decoder.recovered)}/{num_blocks}")
+        print(f"QR {idx}: degree={len(indices)}, recovered={decoder.num_recovered}/{num_blocks}")
         idx += 1
 
     # --------------------------------------------------------
     # Step 4: Write recovered file
     # --------------------------------------------------------
     if decoder.is_complete():
-        decoded_data = b''.join(decoder.recovered[i] for i in range(num_blocks))
-        decoded_data = decoded_data[:file_size]
+        decoded_data = decoder.get_data(file_size)
 
 
         output_path = os.path.join(OUTPUT_DIR, f"{file_name}")
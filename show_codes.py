@@ -14,6 +14,7 @@ Each packet QR code contains:
 
 Functions:
     create_qr: Generates a QR code image from string data
+    produce_frames: Encodes packets into QR frames on a worker thread
     indices_to_bitmask: Converts block indices to a compact bitmask
     encode_packet_with_bitmask: Combines bitmask and payload into base64 string
 """
@@ -21,24 +22,65 @@ Functions:
 import qrcode
 import matplotlib.pyplot as plt
 import math
+import queue
+import threading
+import numpy as np
 from tools import choose_block_size, encode_packet_with_bitmask, lt_encoder, MAX_PAYLOAD_SIZE
 
-def create_qr(data_str: str, version=40):
+_QR_CACHE = {} # {(version, data length in bytes) : configured QRCode reused across frames}
+
+def create_qr(data_str: str, version=None):
     """
     Create a QR code image from the given data string.
+    The configured QRCode is cached per version and data length (in UTF-8
+    bytes) and reused for every frame. The first frame of each key fixes the
+    smallest version (>= version) that fits and its mask pattern; later
+    frames skip both searches. Data is always stored in byte mode, so every
+    frame under one key (all packets of a file share a length) fits.
     """
-    qr = qrcode.QRCode(
-        version=version,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4
-    )
-    qr.add_data(data_str)
-    qr.make(fit=True)
+    data = data_str.encode('utf-8')
+    key = (version, len(data))
+    qr = _QR_CACHE.get(key)
+    if qr is None:
+        qr = qrcode.QRCode(
+            version=version,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4
+        )
+        _QR_CACHE[key] = qr
+    else:
+        qr.clear()
+    qr.add_data(qrcode.util.QRData(data, mode=qrcode.util.MODE_8BIT_BYTE))
+    if qr.mask_pattern is None:
+        qr.best_fit(start=version)
+        # scoring all 8 masks is most of the encoding time, and packets of
+        # random data score about the same under any mask
+        qr.mask_pattern = qr.best_mask_pattern()
+    qr.make(fit=False)
     img = qr.make_image(fill_color="black", back_color="white")
 
     return img
 
+def produce_frames(encoder_gen, num_blocks: int, frames: queue.Queue):
+    """
+    Encode packets into QR frames and queue them for display.
+    Runs on a worker thread so the next frames are built while the
+    display loop shows the current one; blocks while the queue is full.
+    An exception is queued in place of a frame so the display loop can
+    re-raise it instead of waiting forever.
+    """
+    try:
+        packet_id = 1
+        for indices, packet in encoder_gen:
+            b64_data = encode_packet_with_bitmask(indices, packet, num_blocks)
+            img = create_qr(b64_data)
+            # img.save(f"qrcodes/{packet_id}.png")
+            packet_id += 1
+            frames.put(np.asarray(img))
+    except Exception as e:
+        frames.put(e)
+
 # --- Main Demonstration ---
 if __name__ == '__main__':
 
@@ -71,22 +113,27 @@ if __name__ == '__main__':
     
     plt.ion()  # Enable interactive mode
     fig, ax = plt.subplots(figsize=(10, 8))
+    ax.axis('off')
+    qr_artist = None  # AxesImage created on the first frame, then updated in place
+
+    # Packets are encoded on a worker thread a few frames ahead
+    frames = queue.Queue(maxsize=4)
+    threading.Thread(
+        target=produce_frames,
+        args=(encoder_gen, num_blocks, frames),
+        daemon=True
+    ).start()
 
-    packet_id = 1
     # Infinite loop: show each new packet as a QR code.
     while True:
-        indices, packet = next(encoder_gen)
-        print("Packet indices:", indices)
-        
-        b64_data = encode_packet_with_bitmask(indices, packet, num_blocks)
-        print(len(b64_data))
-        
-        img = create_qr(b64_data)
-        # img.save(f"qrcodes/{packet_id}.png")
-        packet_id += 1
-        
-        ax.clear()
-        ax.imshow(img, cmap='gray')
-        plt.axis('off')
-        plt.draw()
-        plt.pause(0.1)
\ No newline at end of file
+        frame = frames.get()
+        if isinstance(frame, Exception):
+            raise frame # the producer failed
+
+        # Swap the pixels of the existing AxesImage instead of clearing the
+        # axes and rebuilding all artists on every frame
+        if qr_artist is None:
+            qr_artist = ax.imshow(frame, cmap='gray', vmin=0, vmax=1)
+        else:
+            qr_artist.set_data(frame)
+        plt.pause(0.1)  # redraws the stale canvas and paces the stream
@@ -9,24 +9,26 @@ Classes:
     IndexOnlyLTDecoder: Simulates the LT decoding process using only packet indices.
 
 Functions:
+    mask_to_indices: Converts a packet bitmask back into a sorted list of block indices.
     simulate_index_only_decoding: Runs the simulation with a list of packets and prints
                                   the step-by-step decoding process.
 """
 
-from collections import defaultdict, deque
+from collections import deque
 
 class IndexOnlyLTDecoder:
     """
     Incremental LT peeling simulator (index-only).
     This simulates only the evolution of packet indices,
     ignoring packet payloads entirely.
+    Packets are int bitmasks (bit i set = block i still unknown).
     """
 
     def __init__(self, num_blocks):
         self.num_blocks = num_blocks # num_blocks: Number of blocks
         self.recovered = set() # recovered input symbols
-        self.packets = list() # residual packets: list of index lists
-        self.block_to_packets = defaultdict(set) # {block : set of packet indices}
+        self.packets = list() # residual packets: list of int bitmasks (bit i set = block i unknown)
+        self.block_to_packets = [set() for _ in range(num_blocks)] # block_idx -> set of packet indices
         self.ripple = deque() # queue of newly recovered blocks
 
     def add_packet(self, indices):
@@ -40,7 +42,10 @@ class IndexOnlyLTDecoder:
             return
 
         packet_id = len(self.packets)
-        self.packets.append(new_indices)
+        mask = 0
+        for i in new_indices:
+            mask |= 1 << i
+        self.packets.append(mask)
 
         for i in new_indices:
             self.block_to_packets[i].add(packet_id)
@@ -59,27 +64,43 @@ class IndexOnlyLTDecoder:
         """
         Incremental peeling process (index-only).
         """
-        while self.ripple:
-            b = self.ripple.popleft()
-            if b in self.recovered:
+        # Bind hot attributes to locals once; the loop below runs per edge
+        ripple = self.ripple
+        recovered = self.recovered
+        packets = self.packets
+        block_to_packets = self.block_to_packets
+
+        while ripple:
+            b = ripple.popleft()
+            if b in recovered:
                 continue
 
-            self.recovered.add(b)
-
-            for packet_id in list(self.block_to_packets[b]):
-                indices = self.packets[packet_id]
-                if b not in indices:
-                    continue
+            recovered.add(b)
 
-                indices.remove(b)
-                self.block_to_packets[b].remove(packet_id)
+            # Drain the set: every entry still contains b, so no snapshot
+            # or membership re-check is needed
+            bit = 1 << b
+            packet_ids = block_to_packets[b]
+            while packet_ids:
+                packet_id = packet_ids.pop()
+                mask = packets[packet_id] ^ bit
+                packets[packet_id] = mask
 
-                if len(indices) == 1:
-                    self._add_to_ripple(indices[0])
+                # Single bit left: degree 1
+                if mask and not mask & (mask - 1):
+                    block_idx = mask.bit_length() - 1
+                    if block_idx not in recovered:
+                        ripple.append(block_idx)
 
     def is_complete(self):
         return len(self.recovered) == self.num_blocks
-    
+
+def mask_to_indices(mask):
+    """
+    Convert a packet bitmask back into its sorted list of block indices.
+    """
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
 def simulate_index_only_decoding(packets, num_blocks):
     decoder = IndexOnlyLTDecoder(num_blocks)
 
@@ -90,13 +111,13 @@ def simulate_index_only_decoding(packets, num_blocks):
 
         print("Packets before adding and peeling:")
         for i, p in enumerate(decoder.packets):
-            print(f"  Packet {i}: {p}")
+            print(f"  Packet {i}: {mask_to_indices(p)}")
 
         decoder.add_packet(indices)
 
         print("Packets after adding and peeling:")
         for i, p in enumerate(decoder.packets):
-            print(f"  Packet {i}: {p}")
+            print(f"  Packet {i}: {mask_to_indices(p)}")
 
         print(f"Recovered so far: {sorted(decoder.recovered)}\n")
 
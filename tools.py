@@ -15,7 +15,10 @@ Constants:
 
 Functions:
     robust_soliton_distribution: Computes the Robust Soliton degree distribution
+    degree_cdf: Returns the cached cumulative degree distribution for k blocks
     choose_degree: Samples a degree according to the distribution
+    choose_degrees: Samples a batch of degrees at once with a NumPy generator
+    choose_indices: Samples d distinct block indices with Floyd's algorithm
     choose_block_size: Optimizes block size for given file and payload constraints
     lt_encoder: Generator function that produces LT encoded packets
 
@@ -23,10 +26,14 @@ Classes:
     LTDecoder: Incremental peeling decoder for recovering original data
 """
 
-import base64
+import binascii
+import bisect
+import itertools
 import math
 import random
-from collections import deque, defaultdict
+from collections import deque
+
+import numpy as np
 
 MAX_PAYLOAD_SIZE = 2210  # max payload size BEFORE base64 encoding in bytes (base64 makes it 4/3 times larger)
 # 2212 * 4/3 = 2949.33 < 2953 (max QR code v40-L capacity), in practice, random 2212 bytes become 2952 bytes after base64 encoding, use 2210 to be safe
@@ -82,10 +89,10 @@ def robust_soliton_distribution(k: int, c: float = 0.1, delta: float = 0.5):
     #   rho(1) = 1 / k
     #   rho(d) = 1 / [d * (d - 1)],   for d = 2, ..., k
     # ------------------------------------------------------------
-    rho = [0.0] * k
+    d = np.arange(1, k + 1, dtype=np.float64)
+    rho = np.empty(k)
     rho[0] = 1.0 / k
-    for d in range(2, k + 1):
-        rho[d - 1] = 1.0 / (d * (d - 1))
+    rho[1:] = 1.0 / (d[1:] * (d[1:] - 1))
 
     # ------------------------------------------------------------
     # Step 4: Robustifying distribution tau(d)
@@ -94,11 +101,9 @@ def robust_soliton_distribution(k: int, c: float = 0.1, delta: float = 0.5):
     #   tau(K) = R * ln(R / delta) / k
     #   tau(d) = 0,                           for d > K
     # ------------------------------------------------------------
-    tau = [0.0] * k
-    for d in range(1, K):
-        tau[d - 1] = R / (d * k)
-
+    tau = np.zeros(k)
     if K >= 1 and K <= k:
+        tau[:K - 1] = R / (d[:K - 1] * k)
         tau[K - 1] = R * math.log(R / delta) / k
 
     # ------------------------------------------------------------
@@ -108,21 +113,39 @@ def robust_soliton_distribution(k: int, c: float = 0.1, delta: float = 0.5):
     #
     # where Z is the normalization constant.
     # ------------------------------------------------------------
-    combined = [r + t for r, t in zip(rho, tau)]
-    Z = sum(combined)
-    mu = [x / Z for x in combined]
+    combined = rho + tau
+    Z = combined.sum()
+    mu = (combined / Z).tolist()
 
     return mu
 
 
-def choose_degree(mu: list):
+_DEGREE_CDF = {} # {k : cumulative Robust Soliton distribution}
+_PACKBITS_MIN_DEGREE = 32 # above this degree np.packbits beats the Python bitmask loop
+
+def degree_cdf(k: int):
+    """
+    Return the cumulative Robust Soliton distribution for k blocks.
+    Computed once per k and cached, since k is fixed for a whole session.
+    """
+    cdf = _DEGREE_CDF.get(k)
+    if cdf is None:
+        cdf = list(itertools.accumulate(robust_soliton_distribution(k)))
+        _DEGREE_CDF[k] = cdf
+    return cdf
+
+
+def choose_degree(cdf: list, rng=random):
     """
     Sample a degree according to the Robust Soliton distribution.
+    Inverse-CDF sampling: one random float and a binary search, O(log k).
 
     Parameters
     ----------
-    mu : list of float
-        Degree distribution for d = 1, 2, ..., k.
+    cdf : list of float
+        Cumulative degree distribution for d = 1, 2, ..., k.
+    rng : random.Random
+        Random generator to draw from (defaults to the global one).
 
     Returns
     -------
@@ -130,11 +153,63 @@ def choose_degree(mu: list):
         Sampled degree.
     """
 
-    return random.choices(
-        population=range(1, len(mu) + 1),
-        weights=mu,
-        k=1
-    )[0]
+    # scale by cdf[-1] so float rounding in the sum can never overshoot
+    return bisect.bisect(cdf, rng.random() * cdf[-1]) + 1
+
+
+def choose_degrees(cdf, n: int, rng: np.random.Generator):
+    """
+    Sample n degrees at once according to the Robust Soliton distribution.
+    Vectorized form of choose_degree: one searchsorted call for the whole batch.
+
+    Parameters
+    ----------
+    cdf : list or np.ndarray of float
+        Cumulative degree distribution for d = 1, 2, ..., k.
+    n : int
+        Number of degrees to draw.
+    rng : np.random.Generator
+        Random generator to draw from.
+
+    Returns
+    -------
+    degrees : list of int
+        Sampled degrees.
+    """
+
+    cdf = np.asarray(cdf)
+    u = rng.random(n) * cdf[-1]
+    return (np.searchsorted(cdf, u, side='right') + 1).tolist()
+
+
+def choose_indices(k: int, d: int, rng=random):
+    """
+    Sample d distinct block indices from range(k) with Floyd's algorithm.
+    O(d) draws with no range(k) or selection pool built per call, which makes
+    it about twice as fast as random.sample for the small degrees LT uses.
+    The order of the returned indices is not uniformly random (not needed here).
+
+    Parameters
+    ----------
+    k : int
+        Number of blocks.
+    d : int
+        Number of indices to draw (0 <= d <= k).
+    rng : random.Random
+        Random generator to draw from (defaults to the global one).
+
+    Returns
+    -------
+    indices : list of int
+        Sampled block indices.
+    """
+
+    randrange = rng.randrange
+    chosen = set()
+    for j in range(k - d, k):
+        t = randrange(j + 1)
+        chosen.add(j if t in chosen else t)
+    return list(chosen)
 
 def choose_block_size(file_size: int, max_payload_size: int):
     """
@@ -145,13 +220,37 @@ def choose_block_size(file_size: int, max_payload_size: int):
         num_blocks = ceil(file_size / block_size)
 
     The bitmask is stored in front of the payload.
+
+    Once 7 * block_size * (block_size + 1) >= file_size, num_blocks drops by
+    at most 7 per extra byte of block, so the bitmask shrinks by at most one
+    byte and the payload size never decreases. The largest valid block size
+    in that range is found by binary search; smaller sizes (only reached when
+    that range has no valid size) are scanned linearly as before.
     """
 
-    for block_size in range(max_payload_size - 1, 0, -1):
-        num_blocks = math.ceil(file_size / block_size)
-        bitmask_size = math.ceil(num_blocks / 8)
+    def payload_size(block_size):
+        num_blocks = -(-file_size // block_size)
+        bitmask_size = (num_blocks + 7) >> 3
+        return bitmask_size + block_size
+
+    # Smallest block size from which payload_size is non-decreasing
+    lo = max(1, int(math.sqrt(file_size / 7)) - 1)
+    while 7 * lo * (lo + 1) < file_size:
+        lo += 1
+
+    hi = max_payload_size - 1
+    if lo <= hi and payload_size(lo) <= max_payload_size:
+        # Invariant: payload_size(lo) fits; find the last block size that fits
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if payload_size(mid) <= max_payload_size:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
 
-        if bitmask_size + block_size <= max_payload_size:
+    for block_size in range(min(lo, max_payload_size) - 1, 0, -1):
+        if payload_size(block_size) <= max_payload_size:
             return block_size
 
     raise ValueError("Cannot find a valid block size")
@@ -162,29 +261,35 @@ def encode_packet_with_bitmask(indices: list, packet: bytes, num_blocks: int):
     Use big-endian byte order for better human readability.
     Combine indices bitmask and the packet data.
     Returns a Base64 string suitable for embedding in a QR code.
+    High-degree packets are packed with np.packbits in one C pass; for the
+    handful of indices most packets carry, the Python loop is cheaper.
     """
-    bitmask = bytearray(math.ceil(num_blocks / 8))
-    for i in indices:
-        bitmask[i // 8] |= 1 << (i % 8)
-    bitmask.reverse()
+    num_bytes = (num_blocks + 7) >> 3
+    if len(indices) > _PACKBITS_MIN_DEGREE:
+        bits = np.zeros(num_bytes * 8, dtype=np.uint8)
+        bits[indices] = 1
+        bitmask = np.packbits(bits, bitorder='little')[::-1].tobytes()
+    else:
+        bitmask = bytearray(num_bytes)
+        for i in indices:
+            bitmask[i // 8] |= 1 << (i % 8)
+        bitmask.reverse()
     combined = bitmask + packet
-    return base64.b64encode(combined).decode('utf-8')
+    return binascii.b2a_base64(combined, newline=False).decode('ascii')
 
 def bitmask_to_indices(bitmask: bytes, num_blocks: int):
     """
     Convert a bitmask (big-endian byte order) into block indices.
+    Read as one big-endian int, bit i is block i, so set bits are popped
+    lowest first: the loop runs once per index (the degree), not per block.
     """
+    # drop padding bits past num_blocks in the last byte
+    mask = int.from_bytes(bitmask, 'big') & ((1 << num_blocks) - 1)
     indices = []
-    idx = 0
-
-    for byte in reversed(bitmask):
-        for bit in range(8):
-            if idx >= num_blocks:
-                return indices
-            if byte & (1 << bit):
-                indices.append(idx)
-            idx += 1
-
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
     return indices
 
 def decode_packet_with_bitmask(encoded_str: str, num_blocks: int):
@@ -197,8 +302,8 @@ def decode_packet_with_bitmask(encoded_str: str, num_blocks: int):
         indices : list[int]
         packet  : bytes
     """
-    combined = base64.b64decode(encoded_str)
-    num_bytes = math.ceil(num_blocks / 8)
+    combined = binascii.a2b_base64(encoded_str)
+    num_bytes = (num_blocks + 7) >> 3
     bitmask = combined[0:num_bytes]
     indices = bitmask_to_indices(bitmask, num_blocks)
     packet = combined[num_bytes:]
@@ -213,29 +318,48 @@ def lt_encoder(file_data: bytes, block_size: int):
     """
     num_blocks = math.ceil(len(file_data) / block_size)
 
-    blocks = [
-        file_data[i * block_size:(i + 1) * block_size]
-        for i in range(num_blocks)
-    ]
+    # Pad once and view the file as a (num_blocks, block_size) uint8 array,
+    # so each packet is a vectorized XOR over its rows
+    padded = bytes(file_data).ljust(num_blocks * block_size, b'\x00')
+    blocks = np.frombuffer(padded, dtype=np.uint8).reshape(num_blocks, block_size)
+    scratch = np.empty(block_size, dtype=np.uint8) # reused XOR accumulator
 
-    mu = robust_soliton_distribution(num_blocks)
+    cdf = np.asarray(degree_cdf(num_blocks))
 
-    while True:
-        d = choose_degree(mu)
-        indices = random.sample(range(num_blocks), d)
+    # Dedicated generators: no shared global state, so several encoders
+    # can run side by side in threads
+    np_rng = np.random.default_rng()
+    rng = random.Random()
 
-        packet = bytearray(blocks[indices[0]].ljust(block_size, b'\x00'))
-        for idx in indices[1:]:
-            block = blocks[idx].ljust(block_size, b'\x00')
-            packet = bytes(a ^ b for a, b in zip(packet, block))
+    while True:
+        # Degrees are drawn in batches to amortize the sampling cost
+        for d in choose_degrees(cdf, 4096, np_rng):
+            indices = choose_indices(num_blocks, d, rng)
+
+            if d == 1:
+                # A lone block is sent as is: slice it straight out of the
+                # padded file, no NumPy round trip
+                idx = indices[0]
+                packet = padded[idx * block_size:(idx + 1) * block_size]
+            elif d <= 6:
+                # Few rows: XOR in place into the scratch buffer, which
+                # skips the fancy-index gather copy of all d rows
+                scratch[:] = blocks[indices[0]]
+                for idx in indices[1:]:
+                    scratch ^= blocks[idx]
+                packet = scratch.tobytes()
+            else:
+                packet = np.bitwise_xor.reduce(blocks[indices], axis=0).tobytes()
 
-        yield indices, packet
+            yield indices, packet
 
 class LTDecoder:
     """
     Incremental peeling decoder for LT Codes.
     This decoder maintains a residual bipartite graph and performs
     event-driven peeling as new encoding symbols arrive.
+    Payload XORs are deferred: a packet's payload is only combined with
+    its recovered blocks once, when the packet is released at degree 1.
     """
 
     def __init__(self, num_blocks):
@@ -248,17 +372,25 @@ class LTDecoder:
                 [3, 6]        # packet 2
             ]
         after:
-            block_to_packets = {
-                6:  {0, 2},
-                11: {0},
-                2:  {0, 1},
-                3:  {2}
-            }
+            block_to_packets = [
+                ...
+                [0, 1],   # block 2
+                [2],      # block 3
+                ...
+                [0, 2],   # block 6
+                ...
+                [0],      # block 11
+            ]
+        Each residual packet keeps only the count of its unknown blocks and
+        their XOR, e.g. packet 2 -> degree 2, 3 ^ 6; at degree 1 the XOR is
+        the index of the last unknown block.
         """
         self.num_blocks = num_blocks # number of blocks
-        self.recovered = defaultdict(set) # {block_idx : data bytes} (immutable recovered symbols)
-        self.packets = list() # residual packets: [[[indices], bytearray(data)], ...]
-        self.block_to_packets = defaultdict(set) # {block_idx : set of packet indices}
+        self.recovered = [None] * num_blocks # recovered[block_idx] : read-only uint8 array, None until recovered
+        self.num_recovered = 0 # number of recovered blocks
+        self.blocks = None # (num_blocks, block_size) uint8 array, allocated on the first packet; recovered rows live here
+        self.packets = list() # residual packets: [[degree, index_xor, np.ndarray(data), [indices]], ...]
+        self.block_to_packets = [[] for _ in range(num_blocks)] # block_idx -> list of packet indices
         self.ripple = deque() # queue of newly recovered blocks
 
     def add_packet(self, indices, pkt):
@@ -268,73 +400,123 @@ class LTDecoder:
         :param indices: list of block indices participating in this packet
         :param pkt: XOR-ed payload of the selected blocks
         """
-        # Residual packet must be mutable
-        pkt = bytearray(pkt)
-
-        # Step 1: Eliminate already recovered blocks
-        new_indices = []
-        for i in indices:
-            if i in self.recovered:
-                rec = self.recovered[i]
-                pkt[:] = (a ^ b for a, b in zip(pkt, rec))
-            else:
-                new_indices.append(i)
+        # Step 1: Find the blocks that are still unknown
+        # (XOR with the already recovered ones is deferred to release time)
+        recovered = self.recovered
+        new_indices = [i for i in indices if recovered[i] is None]
 
         # If no unknown symbols remain, this packet carries no new information
         if not new_indices:
             return
 
+        if self.blocks is None:
+            self.blocks = np.zeros((self.num_blocks, len(pkt)), dtype=np.uint8)
+
+        # Degree 1 already: recover the block directly, the packet never
+        # needs to enter the residual graph
+        if len(new_indices) == 1:
+            self._recover(new_indices[0], np.frombuffer(pkt, dtype=np.uint8), indices)
+            self._peel()
+            return
+
         packet_id = len(self.packets) # new packet index
-        self.packets.append([new_indices, pkt])
+        index_xor = 0
+        for i in new_indices:
+            index_xor ^= i
+        # bytes() pins the payload: the caller may reuse a mutable buffer
+        packet = [len(new_indices), index_xor, np.frombuffer(bytes(pkt), dtype=np.uint8), list(indices)]
+        self.packets.append(packet)
 
         # Update adjacency structure
         for i in new_indices:
-            self.block_to_packets[i].add(packet_id)
-
-        # Step 2: If degree is 1, release a new block
-        if len(new_indices) == 1:
-            self._add_to_ripple(new_indices[0], pkt)
+            self.block_to_packets[i].append(packet_id)
 
-        # Step 3: Run the LT peeling process
+        # Step 2: Run the LT peeling process
         self._peel()
 
-    def _add_to_ripple(self, block_idx, pkt):
+    def _release(self, packet):
+        """
+        Release the single unknown block left in a packet into the ripple.
+        All deferred XORs with recovered blocks are flushed here, once, so
+        packets that never reach degree 1 cost no payload work at all.
+        """
+        _, block_idx, pkt, indices = packet
+        packet[:] = [0, 0, None, None] # tombstone: the packet is fully consumed
+
+        if self.recovered[block_idx] is None:
+            self._recover(block_idx, pkt, indices)
+
+    def _recover(self, block_idx, pkt, indices):
+        """
+        Recover block_idx from a payload whose other indices are all known.
+        """
+        # Write the block straight into its row of the pre-stacked array
+        rec = self.blocks[block_idx]
+        rec[:] = pkt
+        for i in indices:
+            if i != block_idx:
+                rec ^= self.recovered[i]
+        self._add_to_ripple(block_idx, rec)
+
+    def _add_to_ripple(self, block_idx, rec):
         """
         Add a newly recovered block to the ripple.
-        The recovered symbol must be immutable.
+        The recovered symbol must be immutable, so rec must be an array
+        owned by the decoder (its row in self.blocks); it is frozen here.
         """
-        if block_idx not in self.recovered:
+        if self.recovered[block_idx] is None:
             # IMPORTANT: freeze the recovered symbol (no shared mutable buffer)
-            self.recovered[block_idx] = bytes(pkt)
+            rec.flags.writeable = False
+            self.recovered[block_idx] = rec
+            self.num_recovered += 1
             self.ripple.append(block_idx)
 
     def _peel(self):
         """
         Perform the LT peeling process (incremental decoding).
+        Only degrees and index XORs are updated here; payloads are combined on release.
         """
-        while self.ripple:
-            b = self.ripple.popleft()
-            rec_pkt = self.recovered[b]
-
-            # Process all encoding symbols that involve block b
-            for packet_id in list(self.block_to_packets[b]):
-                indices, pkt = self.packets[packet_id]
-                if b not in indices:
+        # Bind hot attributes to locals once; the loop below runs per edge
+        ripple = self.ripple
+        packets = self.packets
+        block_to_packets = self.block_to_packets
+
+        while ripple:
+            b = ripple.popleft()
+
+            # Process all encoding symbols that involve block b.
+            # Each block is peeled once, so its edge list is consumed whole
+            # and dropped afterwards instead of removing entries one by one.
+            packet_ids = block_to_packets[b]
+            for packet_id in packet_ids:
+                packet = packets[packet_id]
+                degree = packet[0]
+                if not degree:
                     continue
 
                 # Remove b from this encoding symbol
-                indices.remove(b)
-                pkt[:] = (a ^ c for a, c in zip(pkt, rec_pkt))
-                self.block_to_packets[b].remove(packet_id)
+                packet[0] = degree - 1
+                packet[1] ^= b
 
-                # If degree drops to 1, release a new block
-                if len(indices) == 1:
-                    new_b = indices[0]
-                    self._add_to_ripple(new_b, pkt)
+                # If degree drops to 1, the index XOR is the last unknown block
+                if degree == 2:
+                    self._release(packet)
+            packet_ids.clear()
 
     def is_complete(self):
         """
         Check whether all k blocks have been recovered.
         """
-        return len(self.recovered) == self.num_blocks
+        return self.num_recovered == self.num_blocks
+
+    def get_data(self, file_size: int):
+        """
+        Return the first file_size bytes of the recovered data.
+        Blocks already sit in order in one contiguous array, so this is a
+        single copy instead of joining num_blocks separate buffers.
+        Only meaningful once is_complete() is True.
+        """
+        if self.blocks is None:
+            return b''
+        return self.blocks.reshape(-1)[:file_size].tobytes()
     
\ No newline at end of file
@@ -2,9 +2,14 @@
 
 import gradio as gr
 import qrcode
-import base64
+from PIL import Image, ImageOps
+import binascii
+import bisect
+import itertools
 import math
+import queue
 import random
+import threading
 import time
 import os
 
@@ -98,14 +103,30 @@ def robust_soliton_distribution(k: int, c: float = 0.1, delta: float = 0.5):
     return mu
 
 
-def choose_degree(mu: list):
+_DEGREE_CDF = {} # {k : cumulative Robust Soliton distribution}
+
+def degree_cdf(k: int):
+    """
+    Return the cumulative Robust Soliton distribution for k blocks.
+    Computed once per k and cached, so regenerating packets for a file
+    of the same size skips the O(k) rebuild.
+    """
+    cdf = _DEGREE_CDF.get(k)
+    if cdf is None:
+        cdf = list(itertools.accumulate(robust_soliton_distribution(k)))
+        _DEGREE_CDF[k] = cdf
+    return cdf
+
+
+def choose_degree(cdf: list):
     """
     Sample a degree according to the Robust Soliton distribution.
+    Inverse-CDF sampling: one random float and a binary search, O(log k).
 
     Parameters
     ----------
-    mu : list of float
-        Degree distribution for d = 1, 2, ..., k.
+    cdf : list of float
+        Cumulative degree distribution for d = 1, 2, ..., k.
 
     Returns
     -------
@@ -113,11 +134,35 @@ def choose_degree(mu: list):
         Sampled degree.
     """
 
-    return random.choices(
-        population=range(1, len(mu) + 1),
-        weights=mu,
-        k=1
-    )[0]
+    # scale by cdf[-1] so float rounding in the sum can never overshoot
+    return bisect.bisect(cdf, random.random() * cdf[-1]) + 1
+
+
+def choose_indices(k: int, d: int):
+    """
+    Sample d distinct block indices from range(k) with Floyd's algorithm.
+    O(d) draws with no range(k) or selection pool built per call.
+    The order of the returned indices is not uniformly random (not needed here).
+
+    Parameters
+    ----------
+    k : int
+        Number of blocks.
+    d : int
+        Number of indices to draw (0 <= d <= k).
+
+    Returns
+    -------
+    indices : list of int
+        Sampled block indices.
+    """
+
+    randrange = random.randrange
+    chosen = set()
+    for j in range(k - d, k):
+        t = randrange(j + 1)
+        chosen.add(j if t in chosen else t)
+    return list(chosen)
 
 
 def validate_params(data_length: int, block_size: int):
@@ -147,23 +192,26 @@ def lt_encoder(file_data: bytes, block_size: int):
     """
     num_blocks = math.ceil(len(file_data) / block_size)
 
+    # Pad the file once (only the last block can be short) and keep each
+    # block as a big int: XOR then runs in C over machine words instead of
+    # a Python loop over bytes
+    padded = file_data.ljust(num_blocks * block_size, b'\x00')
     blocks = [
-        file_data[i * block_size:(i + 1) * block_size]
+        int.from_bytes(padded[i * block_size:(i + 1) * block_size], 'big')
         for i in range(num_blocks)
     ]
 
-    mu = robust_soliton_distribution(num_blocks)
+    cdf = degree_cdf(num_blocks)
 
     while True:
-        d = choose_degree(mu)
-        indices = random.sample(range(num_blocks), d)
+        d = choose_degree(cdf)
+        indices = choose_indices(num_blocks, d)
 
-        packet = bytearray(blocks[indices[0]].ljust(block_size, b'\x00'))
-        for idx in indices[1:]:
-            block = blocks[idx].ljust(block_size, b'\x00')
-            packet = bytes(a ^ b for a, b in zip(packet, block))
+        packet = 0
+        for idx in indices:
+            packet ^= blocks[idx]
 
-        yield indices, packet
+        yield indices, packet.to_bytes(block_size, 'big')
 
 
 def encode_packet_with_bitmask_web(indices: list, packet: bytes, num_blocks: int):
@@ -173,34 +221,53 @@ def encode_packet_with_bitmask_web(indices: list, packet: bytes, num_blocks: int
     Then combine the bitmask and the packet data.
     Returns a Base64 string suitable for embedding in a QR code.
     """
-    bitmask = bytearray(math.ceil(num_blocks / 8))
+    bitmask = bytearray((num_blocks + 7) >> 3)
     for i in indices:
         bitmask[i // 8] |= 1 << (i % 8)
     bitmask.reverse()
-    payload = bytes(bitmask) + packet
-    return base64.b64encode(payload).decode('utf-8')
+    bitmask += packet # append in place: bitmask becomes the whole payload
+    return binascii.b2a_base64(bitmask, newline=False).decode('ascii')
+
 
+_QR_LAYOUT = {} # {data length in bytes : (version, mask_pattern) fixed by the first QR of that length}
 
 def create_qr_web(data: str):
     """
     Create a QR code image from the given data string.
+    All packets of one file have the same length, so the version and mask
+    pattern found for the first one are reused: scoring the 8 masks is most
+    of the encoding time, and random data scores about the same under any.
+    Data is stored in byte mode so that version always fits.
     """
     qr = qrcode.QRCode(
-        version=None,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
         box_size=10,
         border=10, # quiet zone
     )
-    qr.add_data(data)
-    qr.make(fit=True)
-    return qr.make_image(
-        fill_color="black",
-        back_color="white"
-    ).get_image()
+    # Key on the UTF-8 byte length: that is what byte mode stores
+    data = data.encode('utf-8')
+    qr.add_data(qrcode.util.QRData(data, mode=qrcode.util.MODE_8BIT_BYTE))
+    layout = _QR_LAYOUT.get(len(data))
+    if layout is None:
+        qr.best_fit()
+        layout = (qr.version, qr.best_mask_pattern())
+        _QR_LAYOUT[len(data)] = layout
+    qr.version, qr.mask_pattern = layout
+    qr.make(fit=False)
+
+    # Rasterize the module matrix in one pass and scale it up, instead of
+    # letting make_image draw every dark module as a separate rectangle
+    n = qr.modules_count
+    pixels = bytes(0 if dark else 255 for row in qr.modules for dark in row)
+    img = Image.frombytes("L", (n, n), pixels).resize((n * qr.box_size, n * qr.box_size), Image.NEAREST)
+    return ImageOps.expand(img, border=qr.border * qr.box_size, fill=255)
 
 
 # ---------------- Gradio UI logic ----------------
 
+POLL_INTERVAL = 0.2 # seconds between stream_packets calls, caps the rate at 5 QR/s
+_SESSION_STOPS = {} # {session_hash : stop Event of that session's running producer}
+
 def prepare(file_path: str, block_size: int):
     # --- MODIFIED: file handling ---
     file_name = os.path.basename(file_path)
@@ -220,9 +287,20 @@ def prepare(file_path: str, block_size: int):
     # --- MODIFIED: encoder uses raw bytes ---
     encoder = lt_encoder(raw, block_size)
 
+    # Packets are encoded and rendered on a worker thread a few frames ahead
+    frames = queue.Queue(maxsize=8)
+    stop = threading.Event()
+    threading.Thread(
+        target=produce_packets,
+        args=(encoder, num_blocks, frames, stop),
+        daemon=True
+    ).start()
+
     # --- MODIFIED: return FULL state ---
     state = {
-        "encoder": encoder,
+        "frames": frames,
+        "stop": stop,
+        "next_frame": time.monotonic(), # monotonic time the next packet QR is due
         "file_size": file_size,
         "num_blocks": num_blocks,
         "block_size": block_size,
@@ -232,30 +310,59 @@ def prepare(file_path: str, block_size: int):
     return header_qr, state
 
 
+def produce_packets(encoder, num_blocks: int, frames: queue.Queue, stop: threading.Event):
+    """
+    Encode packets into QR images ahead of display.
+    Runs on a worker thread per session so encoding and QR rendering stay
+    off the Gradio callbacks; blocks while the queue is full and returns
+    once stop is set. On failure a None sentinel is queued.
+    """
+    def offer(item):
+        # Wait for room in the queue, giving up once the session is stopped
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for indices, packet in encoder:
+            b64 = encode_packet_with_bitmask_web(indices, packet, num_blocks)
+            if not offer(create_qr_web(b64)):
+                # Stopped: drop the queued frames, the state may outlive us
+                while True:
+                    try:
+                        frames.get_nowait()
+                    except queue.Empty:
+                        return
+    except Exception as e:
+        print("produce_packets error:", e)
+        offer(None) # sentinel: tell stream_packets to clear the image
+
+
 def stream_packets(state, running, rate):
     # Guard: stream_packets is called periodically even before Start is clicked
     if not running or state is None:
         return gr.update()
 
-    encoder = state["encoder"]
-    # file_size = state["file_size"]
-    num_blocks = state["num_blocks"]
-    # block_size = state["block_size"]
-
+    # Pace by the clock instead of sleeping: a poll that comes early just
+    # keeps the current frame (half a poll of slack absorbs timer jitter)
     update_interval = 1.0 / rate
+    now = time.monotonic()
+    if now < state["next_frame"] - POLL_INTERVAL / 2:
+        return gr.update()
 
     try:
-        indices, packet = next(encoder)
-    except StopIteration:
-        return gr.update(value=None)
-    except Exception as e:
-        print("stream_packets error:", e)
-        return gr.update(value=None)
+        qr_img = state["frames"].get_nowait()
+    except queue.Empty:
+        return gr.update() # producer is behind: keep the current frame
 
-    print(indices)
-    b64 = encode_packet_with_bitmask_web(indices, packet, num_blocks)
-    qr_img = create_qr_web(b64)
-    time.sleep(update_interval)
+    if qr_img is None:
+        return gr.update(value=None) # producer failed: clear the image
+
+    state["next_frame"] = max(state["next_frame"], now - update_interval) + update_interval
     return qr_img
 
 
@@ -278,32 +385,52 @@ with gr.Blocks(title="LT Codes Generator", theme=gr.themes.Soft()) as demo:
             header_qr = gr.Image(label="Header QR", type="pil")
             packet_qr = gr.Image(label="Packet QR", type="pil")
 
-    state = gr.State()
+    def stop_producer(state):
+        if state is not None:
+            state["stop"].set()
+
+    # Gradio keeps a closed session's state for an hour (its closed-session
+    # TTL, which overrides time_to_live) before running delete_callback, so
+    # this is only a backstop; closing or reloading the tab is handled by
+    # on_unload below
+    state = gr.State(delete_callback=stop_producer)
     running = gr.State(False)
 
-    def on_start(file, block_size, rate):
+    def on_start(file, block_size, rate, old_state, request: gr.Request):
+        stop_producer(old_state) # restarting: retire the previous producer
         header, state = prepare(file, block_size)
+        _SESSION_STOPS[request.session_hash] = state["stop"]
         return header, state, True # [header_qr, state, running]
     
-    def on_stop():
+    def on_stop(state, request: gr.Request):
+        stop_producer(state)
+        _SESSION_STOPS.pop(request.session_hash, None)
         return False, None, None # [running, header_qr, packet_qr]
 
+    def on_unload(request: gr.Request):
+        # Runs when the tab is closed or reloaded: stop the producer now
+        stop = _SESSION_STOPS.pop(request.session_hash, None)
+        if stop is not None:
+            stop.set()
+
     start_btn.click(
         fn=on_start,
-        inputs=[file_input, block_size, rate],
+        inputs=[file_input, block_size, rate, state],
         outputs=[header_qr, state, running],
     )
     stop_btn.click(
         fn=on_stop,
-        inputs=None,
+        inputs=[state],
         outputs=[running, header_qr, packet_qr],
     )
 
+    demo.unload(on_unload)
+
     demo.load(
         fn=stream_packets,
         inputs=[state, running, rate],
         outputs=packet_qr,
-        every=0.2,
+        every=POLL_INTERVAL,
     )  # safe: stream_packets ignores empty state
 
 if __name__ == "__main__":